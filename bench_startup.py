@@ -0,0 +1,69 @@
+"""Startup-time benchmark for the `main.py` CLI.
+
+Times `main.py --help` and `main.py rank` (against a small synthetic
+predictions file, so it measures startup rather than unpickling) in fresh
+interpreters, and checks that importing `main` pulls in none of the heavy
+numerical libraries. Exits nonzero if either check regresses.
+"""
+import cPickle
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+STARTUP_BUDGET = 0.5  # seconds, best of REPEATS
+REPEATS = 5
+HEAVY_MODULES = ('numpy', 'scipy', 'sklearn')
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MAIN = os.path.join(HERE, 'main.py')
+
+
+def best_time(argv, repeats=REPEATS):
+    best = None
+    with open(os.devnull, 'w') as devnull:
+        for _ in xrange(repeats):
+            start = time.time()
+            subprocess.check_call([sys.executable, MAIN] + argv,
+                                  stdout=devnull, cwd=HERE)
+            elapsed = time.time() - start
+            best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def heavy_imports():
+    check = ('import sys, main; '
+             'print " ".join(sorted(set(m.split(".")[0] for m in sys.modules '
+             'if m.split(".")[0] in %r)))' % (HEAVY_MODULES,))
+    return subprocess.check_output([sys.executable, '-c', check],
+                                   cwd=HERE).split()
+
+
+def main():
+    ranks = {0: {'QB': [(300.0, ('Drew Brees', 'NOR', 0)),
+                        (250.0, ('Mark Sanchez', 'NYJ', 1))]}}
+    fd, predictions = tempfile.mkstemp(suffix='.pkl')
+    with os.fdopen(fd, 'wb') as stream:
+        cPickle.dump(ranks, stream, cPickle.HIGHEST_PROTOCOL)
+
+    ok = True
+    try:
+        for argv in (['--help'], ['rank', '--predictions', predictions]):
+            elapsed = best_time(argv)
+            within = elapsed <= STARTUP_BUDGET
+            ok = ok and within
+            print '%-10s %.3fs %s' % (argv[0], elapsed,
+                                      'ok' if within else 'OVER BUDGET')
+    finally:
+        os.remove(predictions)
+
+    heavy = heavy_imports()
+    if heavy:
+        ok = False
+        print 'import main pulled in: %s' % ', '.join(heavy)
+
+    return 0 if ok else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
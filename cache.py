@@ -0,0 +1,126 @@
+import cPickle
+import hashlib
+import os
+import shutil
+import tempfile
+from logging import info
+from logging import warning
+
+from numpy import __version__ as numpy_version
+from numpy import ascontiguousarray
+
+from constants import CACHE_DIR
+from constants import CACHE_MAX_BYTES
+from constants import CACHE_VERSION
+
+
+def result_key(matrix, features, model, **params):
+    """Content hash identifying an experiment.
+
+    Covers the feature matrix (values, shape, and column names), the model's
+    class and parameters, any extra keyword parameters (eg seed and
+    n_folds), the numpy and scikit-learn versions, and CACHE_VERSION.
+    Anything that would change the result must go into the key.
+    """
+    import sklearn
+
+    digest = hashlib.sha1()
+    matrix = ascontiguousarray(matrix)
+    digest.update(repr((matrix.shape, matrix.dtype.str, features)))
+    digest.update(matrix.tostring())
+    model_class = type(model)
+    digest.update(repr((model_class.__module__, model_class.__name__,
+                        sorted(model.get_params().items()))))
+    digest.update(repr(sorted(params.items())))
+    digest.update(repr((numpy_version, sklearn.__version__,
+                        CACHE_VERSION)))
+    return digest.hexdigest()
+
+
+class ResultCache(object):
+    """Size-bounded LRU cache of pickled results, one file per key.
+
+    Recency is tracked with file mtimes, which are bumped on every hit, so the
+    cache survives across runs without any separate index.
+    """
+
+    def __init__(self, path=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+
+    def _filename(self, key):
+        return os.path.join(self.path, key + '.pkl')
+
+    def get(self, key):
+        """Return the cached value for key, or None on a miss.
+
+        Entries that fail to load (damaged files, or pickles from library
+        versions that no longer match) are deleted and treated as misses.
+        """
+        filename = self._filename(key)
+        if not os.path.exists(filename):
+            return None
+        try:
+            with open(filename, 'rb') as stream:
+                value = cPickle.load(stream)
+        except Exception as e:
+            warning('dropping unreadable cache entry %s: %r' % (key, e))
+            os.remove(filename)
+            return None
+        os.utime(filename, None)
+        info('cache hit: %s' % key)
+        return value
+
+    def put(self, key, value):
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        filename = self._filename(key)
+        # Write-then-rename so an interrupted run never leaves a truncated
+        # entry behind.
+        tmpname = '%s.%d.tmp' % (filename, os.getpid())
+        with open(tmpname, 'wb') as stream:
+            cPickle.dump(value, stream, cPickle.HIGHEST_PROTOCOL)
+        os.rename(tmpname, filename)
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.path):
+            if not name.endswith('.pkl'):
+                continue
+            stat = os.stat(os.path.join(self.path, name))
+            entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for mtime, size, name in entries)
+        for mtime, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            info('cache evict: %s' % name)
+            os.remove(os.path.join(self.path, name))
+            total -= size
+
+
+def test_result_cache():
+    path = tempfile.mkdtemp()
+    try:
+        cache = ResultCache(path)
+        assert cache.get('a') is None
+        for key in 'abc':
+            cache.put(key, key * 100)
+        assert cache.get('a') == 'a' * 100
+
+        # Make 'a' the most recently used, then 'c', leaving 'b' the oldest.
+        for age, key in enumerate('cba'):
+            os.utime(cache._filename(key), (1000 - age, 1000 - age))
+        assert cache.get('a') == 'a' * 100
+        entry_size = os.path.getsize(cache._filename('a'))
+        cache.max_bytes = 3 * entry_size
+        cache.put('d', 'd' * 100)
+        assert cache.get('b') is None
+        assert all(cache.get(key) is not None for key in 'acd')
+
+        with open(cache._filename('c'), 'wb') as stream:
+            stream.write('not a pickle')
+        assert cache.get('c') is None
+        assert not os.path.exists(cache._filename('c'))
+    finally:
+        shutil.rmtree(path)
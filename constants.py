@@ -8,5 +8,23 @@ SPECIAL_CASE_TRADES = {
     ('Zach Miller', 'SEA', 2011): ('Zach Miller', 'OAK', 2010)
 }
 
+# Saved by `main.py ingest` and `main.py predict` respectively.
+INGEST_ARTIFACT = 'ingest.pkl'
+PREDICTIONS_ARTIFACT = 'predictions.pkl'
+
 ID = ('id', 'identifier')
 DELTA = ('delta', 'identifier')
+# The season a row's objective comes from. Deltas count back along each
+# player's own seasons, so a delta does not map to one calendar year.
+SEASON = ('season', 'identifier')
+
+# On-disk memoization of cross-validation and prediction results; the least
+# recently used entries are evicted once the directory exceeds the size limit.
+# Seeds are part of the cache key, so cached runs use a fixed one for the
+# folds and for every model's random_state.
+CACHE_DIR = '.result_cache'
+CACHE_MAX_BYTES = 64 * 2**20
+CACHE_SEED = 0
+# Part of the cache key along with the numpy and scikit-learn versions. Bump
+# it whenever code that produces cached results changes.
+CACHE_VERSION = 1
@@ -1,5 +1,3 @@
-from scipy.stats import kendalltau
-
 from constants import BASE_YEAR
 from constants import DELTA
 from constants import ID
@@ -17,6 +15,7 @@ def kendall_tau(position_scores, position_predictions, topN=TOP_N):
     Extract IDs from each, find intersection, remap to unique IDs in [0,N), and
     use scipy.
     """
+    from scipy.stats import kendalltau
 
     def get_ids(score_list):
         return [id for score, (name, team, id) in score_list[:topN]]
@@ -52,16 +51,17 @@ def compute_taus(delta2pos2scores, delta2pos2preds):
     return taus
 
 
-def position_ranking_lists(identifiers, scores, id2name):
+def position_ranking_lists(identifiers, scores, id2name, key=DELTA):
+    """Rank players by position within each value of the `key` identifier."""
     positions = {position for name, team, position in id2name.itervalues()}
-    deltas = {ident[DELTA] for ident in identifiers}
+    deltas = {ident[key] for ident in identifiers}
     delta2pos2list = {}
     for delta in deltas:
         pos2list = {}
         for position in positions:
             pos_idxs = [idx for idx, ident in enumerate(identifiers)
                         if (id2name[ident[ID]][2] == position and
-                            ident[DELTA] == delta)]
+                            ident[key] == delta)]
 
             names = [id2name[ident[ID]][:2] + (ident[ID],) for ident
                      in select_rows(identifiers, pos_idxs)]
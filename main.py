@@ -1,16 +1,27 @@
+"""Command-line driver.
+
+Each subcommand only imports what it needs: `rank` reads a plain pickle and
+never touches numpy, scipy, or scikit-learn, and model modules are imported
+only when a model is built. Running with no subcommand does ingest, evaluate,
+and predict in sequence; `--backtest` and `--no-cache` are still accepted
+there and passed on to those steps.
+"""
+import argparse
+import cPickle
 import logging
+import os
+import sys
+from collections import OrderedDict
+from importlib import import_module
 from random import randint
 
 from constants import BASE_YEAR
+from constants import CACHE_SEED
 from constants import ID
+from constants import INGEST_ARTIFACT
+from constants import PREDICTIONS_ARTIFACT
 from constants import TOP_N
 from constants import SPECIAL_CASE_TRADES
-from evaluation import pos_rank_row_to_str
-from evaluation import position_ranking_lists
-from parser import load_files
-from prediction import construct_feature_matrix
-from prediction import cross_validate
-from prediction import predict_current_year
 
 
 logging.getLogger().setLevel(logging.ERROR)
@@ -20,11 +31,67 @@ warning = logging.warning
 error = logging.error
 
 
-def dump_predictions(delta2pos2preds, topN=TOP_N, base_year=BASE_YEAR):
+# name: (sklearn module, estimator class, constructor params)
+MODELS = OrderedDict([
+    ('linear', ('linear_model', 'LinearRegression', {})),
+    ('ridge', ('linear_model', 'Ridge', {})),
+    ('rf', ('ensemble', 'RandomForestRegressor', {})),
+    ('extratrees', ('ensemble', 'ExtraTreesRegressor', {})),
+    ('adaboost', ('ensemble', 'AdaBoostRegressor', {})),
+    ('gbrt', ('ensemble', 'GradientBoostingRegressor', {})),
+    ('svr', ('svm', 'SVR', {})),
+    ('nusvr', ('svm', 'NuSVR', {})),
+    ('sgd', ('linear_model', 'SGDRegressor', {})),
+])
+EVALUATE_MODELS = ['linear', 'ridge', 'rf', 'extratrees', 'adaboost', 'gbrt',
+                   'svr', 'nusvr']
+# Flags accepted with no subcommand, from before main.py had subcommands.
+PIPELINE_FLAGS = ('--backtest', '--no-cache')
+
+# When walking forward season by season, sgd extends its previous fit with
+# partial_fit instead of retraining on all history at each step.
+BACKTEST_MODELS = EVALUATE_MODELS + ['sgd']
+
+
+def make_model(name, seed=None, **params):
+    """Build a model by name; seed fills in random_state where it applies."""
+    module_name, class_name, defaults = MODELS[name]
+    module = import_module('sklearn.' + module_name)
+    kwargs = dict(defaults)
+    kwargs.update(params)
+    model = getattr(module, class_name)(**kwargs)
+    if seed is not None and 'random_state' in model.get_params():
+        model.set_params(random_state=seed)
+    return model
+
+
+def _model_name(name):
+    if name not in MODELS:
+        raise argparse.ArgumentTypeError(
+            'unknown model %r (choose from %s)' % (name, ', '.join(MODELS)))
+    return name
+
+
+def _save(obj, filename):
+    with open(filename, 'wb') as stream:
+        cPickle.dump(obj, stream, cPickle.HIGHEST_PROTOCOL)
+
+
+def _load(filename):
+    with open(filename, 'rb') as stream:
+        return cPickle.load(stream)
+
+
+def dump_predictions(delta2pos2preds, topN=TOP_N, base_year=BASE_YEAR,
+                     positions=None):
+    from evaluation import pos_rank_row_to_str
+
     for delta in delta2pos2preds:
         pos2preds = delta2pos2preds[delta]
         year = base_year - delta
         for position in sorted(pos2preds):
+            if positions and position not in positions:
+                continue
             print
             print '=============== %s (%d) ==============' % (position, year)
             print 'Predicted'
@@ -34,7 +101,11 @@ def dump_predictions(delta2pos2preds, topN=TOP_N, base_year=BASE_YEAR):
             print
 
 
-def main():
+def ingest(args):
+    """Parse the CSVs and save the feature matrix for later subcommands."""
+    from parser import load_files
+    from prediction import construct_feature_matrix
+
     id2year2stats = load_files(
         {year: 'fant%d.csv' % year for year in xrange(2008, 2013)},
         SPECIAL_CASE_TRADES)
@@ -52,38 +123,149 @@ def main():
     id2name = {ident[ID]: id_to_useful_name(ident[ID]) for ident in
                identifiers}
 
-    from sklearn import linear_model
-    from sklearn import ensemble
-    from sklearn import svm
-
-    seed = randint(0, 2**32 - 1)
-    for model in [linear_model.LinearRegression(),
-                  linear_model.Ridge(),
-                  ensemble.RandomForestRegressor(),
-                  ensemble.ExtraTreesRegressor(),
-                  ensemble.AdaBoostRegressor(),
-                  ensemble.GradientBoostingRegressor(),
-                  svm.SVR(),
-                  svm.NuSVR(),
-                  ]:
+    _save({'matrix': matrix,
+           'identifiers': identifiers,
+           'features': features,
+           'id2name': id2name,
+           'current_players': current_players},
+          args.artifact)
+
+
+def evaluate(args):
+    """Cross-validate (or backtest) the selected models."""
+    from cache import ResultCache
+    from prediction import cross_validate
+    from prediction import walk_forward_backtest
+
+    data = _load(args.artifact)
+    matrix, identifiers, features, id2name = (
+        data['matrix'], data['identifiers'], data['features'],
+        data['id2name'])
+
+    # A cached result is only meaningful if it is reproducible, so cached
+    # runs fix both the fold seed and every model's random_state.
+    cache = None if args.no_cache else ResultCache()
+    seed = randint(0, 2**32 - 1) if args.no_cache else CACHE_SEED
+    model_seed = None if args.no_cache else CACHE_SEED
+    names = args.models or (BACKTEST_MODELS if args.backtest
+                            else EVALUATE_MODELS)
+    for name in names:
+        model = make_model(name, seed=model_seed)
         print str(model).split('(')[0]
-        cross_validate(matrix, identifiers, features, id2name, model,
-                       n_folds=10, seed=seed)
+        if args.backtest:
+            walk_forward_backtest(matrix, identifiers, features, id2name,
+                                  model)
+        else:
+            cross_validate(matrix, identifiers, features, id2name, model,
+                           n_folds=args.folds, seed=seed, cache=cache)
         print
 
-    model = ensemble.RandomForestRegressor()
+
+def predict(args):
+    """Predict this year's scores from a saved ingest artifact."""
+    from cache import ResultCache
+    from evaluation import position_ranking_lists
+    from prediction import predict_current_year
+
+    data = _load(args.artifact)
+    identifiers, id2name, current_players = (
+        data['identifiers'], data['id2name'], data['current_players'])
+
+    cache = None if args.no_cache else ResultCache()
+    model = make_model(args.model,
+                       seed=None if args.no_cache else CACHE_SEED)
     current_predictions, current_ids = \
-        predict_current_year(matrix, identifiers, features, id2name, model)
+        predict_current_year(data['matrix'], identifiers, data['features'],
+                             id2name, model, cache=cache)
 
     current_predictions, current_ids = zip(
-        *[(pred, ident) for pred, ident
+        *[(float(pred), ident) for pred, ident
           in zip(current_predictions, current_ids)
           if ident[ID] in current_players])
 
     current_predicted_ranks = position_ranking_lists(
         current_ids, current_predictions, id2name)
 
-    dump_predictions(current_predicted_ranks)
+    # Plain Python types only, so `rank` can load this without numpy.
+    _save(current_predicted_ranks, args.predictions)
+    dump_predictions(current_predicted_ranks, topN=args.top,
+                     positions=args.positions)
+
+
+def rank(args):
+    """Print rankings saved by `predict`."""
+    dump_predictions(_load(args.predictions), topN=args.top,
+                     positions=args.positions)
+
+
+def build_parser():
+    artifact = argparse.ArgumentParser(add_help=False)
+    artifact.add_argument('--artifact', default=INGEST_ARTIFACT,
+                          help='ingested feature matrix '
+                          '(default: %(default)s)')
+
+    no_cache = argparse.ArgumentParser(add_help=False)
+    no_cache.add_argument('--no-cache', action='store_true',
+                          help='ignore the result cache and use random '
+                          'seeds')
+
+    output = argparse.ArgumentParser(add_help=False)
+    output.add_argument('--predictions', default=PREDICTIONS_ARTIFACT,
+                        help='saved rankings (default: %(default)s)')
+    output.add_argument('--top', type=int, default=TOP_N,
+                        help='players to list per position '
+                        '(default: %(default)s)')
+    output.add_argument('--position', dest='positions', action='append',
+                        help='only list this position; may be repeated')
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers()
+
+    sub = subparsers.add_parser('ingest', parents=[artifact],
+                                help=ingest.__doc__)
+    sub.set_defaults(command=ingest)
+
+    sub = subparsers.add_parser('evaluate', parents=[artifact, no_cache],
+                                help=evaluate.__doc__)
+    sub.add_argument('models', nargs='*', type=_model_name, metavar='model',
+                     help='models to evaluate: %s' % ', '.join(MODELS))
+    sub.add_argument('--backtest', action='store_true',
+                     help='walk forward season by season instead of k-fold')
+    sub.add_argument('--folds', type=int, default=10)
+    sub.set_defaults(command=evaluate, requires=('artifact', 'ingest'))
+
+    sub = subparsers.add_parser('predict',
+                                parents=[artifact, no_cache, output],
+                                help=predict.__doc__)
+    sub.add_argument('--model', type=_model_name, default='rf',
+                     help='one of: %s (default: %%(default)s)' %
+                     ', '.join(MODELS))
+    sub.set_defaults(command=predict, requires=('artifact', 'ingest'))
+
+    sub = subparsers.add_parser('rank', parents=[output], help=rank.__doc__)
+    sub.set_defaults(command=rank, requires=('predictions', 'predict'))
+
+    return parser
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    parser = build_parser()
+    if set(argv) <= set(PIPELINE_FLAGS):
+        no_cache = [flag for flag in argv if flag == '--no-cache']
+        commands = [['ingest'], ['evaluate'] + argv, ['predict'] + no_cache]
+    else:
+        commands = [argv]
+    for command in commands:
+        args = parser.parse_args(command)
+        requires = getattr(args, 'requires', None)
+        if requires:
+            dest, producer = requires
+            if not os.path.exists(getattr(args, dest)):
+                parser.error('%s not found; run `main.py %s` first' %
+                             (getattr(args, dest), producer))
+        args.command(args)
 
     return
 
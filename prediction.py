@@ -5,12 +5,14 @@ from logging import info
 
 from numpy import array
 from numpy import empty
+from numpy import isnan
 from numpy import nan
-from sklearn.cross_validation import KFold
-from sklearn.preprocessing import Imputer
-from sklearn.preprocessing import StandardScaler
 
+from cache import result_key
+from constants import BASE_YEAR
 from constants import DELTA
+from constants import ID
+from constants import SEASON
 from evaluation import compute_taus
 from evaluation import position_ranking_lists
 
@@ -90,6 +92,9 @@ def featurize_player(year2stats, id=None):
 
     Some features (age, position) should just be taken from the last year
     and don't need to be replicated across years.
+
+    The player's seasons, most recent first, are kept under 'seasons' so that
+    split_player can tag each row with the season it predicts.
     """
 
     years = sorted(year2stats, reverse=True)
@@ -103,6 +108,7 @@ def featurize_player(year2stats, id=None):
         for feat_key, fn in TRACKED_STATS:
             features[(feat_key, year_delta)] = fn(stats)
 
+    features['seasons'] = years
     if id is not None:
         features['id'] = id
 
@@ -128,7 +134,9 @@ def split_player(features):
     tracked_features, deltas = zip(*tracked)
     deltas = set(deltas)
     fixed = [x[0] for x in FIXED_STATS]
-    identifiers = [feat for feat in features if is_identifier(feat)]
+    seasons = features.get('seasons')
+    identifiers = [feat for feat in features
+                   if is_identifier(feat) and feat != 'seasons']
 
     base_row = {(ident, 'identifier'): features[ident]
                 for ident in identifiers}
@@ -140,6 +148,8 @@ def split_player(features):
             continue
         new_row = copy(base_row)
         new_row[DELTA] = delta
+        if seasons is not None:
+            new_row[SEASON] = seasons[delta - 1]
 
         # At delta=1 we have the current age. Correct for the past.
         new_row[('age', None)] -= (delta - 1)
@@ -206,8 +216,49 @@ def construct_feature_matrix(id2year2stats):
 
 
 def cross_validate(matrix, identifiers, features, id2name, model, n_folds=3,
-                   seed=None):
-    """Use data from all year deltas > target_delta to predict scores."""
+                   seed=None, cache=None):
+    """Use data from all year deltas > target_delta to predict scores.
+
+    If a ResultCache is given, per-fold predictions are looked up by a hash
+    of the matrix, model, seed, and n_folds, and only computed on a miss. On
+    a hit the model is left unfitted.
+    """
+    folds = None
+    if cache is not None:
+        key = result_key(matrix, features, model, task='cross_validate',
+                         n_folds=n_folds, seed=seed)
+        folds = cache.get(key)
+    if folds is None:
+        folds = _cross_validate_folds(matrix, features, model, n_folds, seed)
+        if cache is not None:
+            cache.put(key, folds)
+
+    accum_test_identifiers = []
+    accum_test_scores = []
+    accum_test_preds = []
+    for test_index, y_test, y_pred in folds:
+        test_identifiers = [identifiers[idx] for idx in test_index]
+        accum_test_identifiers.extend(test_identifiers)
+        accum_test_scores.extend(y_test)
+        accum_test_preds.extend(y_pred)
+
+    pos_ranks_true = position_ranking_lists(
+        accum_test_identifiers, accum_test_scores, id2name)
+    pos_ranks_pred = position_ranking_lists(
+        accum_test_identifiers, accum_test_preds, id2name)
+    taus = compute_taus(pos_ranks_true, pos_ranks_pred)
+    for deltapos in sorted(taus, key=lambda x: (x[1], x[0])):
+        print deltapos, taus[deltapos]
+
+    return
+
+
+def _cross_validate_folds(matrix, features, model, n_folds, seed):
+    """Return [(test_index, y_test, y_pred)], one entry per fold."""
+    from sklearn.cross_validation import KFold
+    from sklearn.preprocessing import Imputer
+    from sklearn.preprocessing import StandardScaler
+
     feature_cols = [idx for idx, (feat, delta) in enumerate(features)
                     if delta != 0]
     objective_index = features.index(('fantasy_points', 0))
@@ -217,9 +268,7 @@ def cross_validate(matrix, identifiers, features, id2name, model, n_folds=3,
         y = _matrix[:, objective_index]
         return X, y
 
-    accum_test_identifiers = []
-    accum_test_scores = []
-    accum_test_preds = []
+    folds = []
     for fold, (train_index, test_index) in \
             enumerate(KFold(n=matrix.shape[0], n_folds=n_folds, shuffle=True,
                             random_state=seed)):
@@ -235,24 +284,223 @@ def cross_validate(matrix, identifiers, features, id2name, model, n_folds=3,
         model.fit(X_train, y_train)
         X_test, y_test = get_features_objective(test_imputed)
         y_pred = model.predict(X_test)
+        folds.append((test_index, y_test, y_pred))
 
-        test_identifiers = [identifiers[idx] for idx in test_index]
-        accum_test_identifiers.extend(test_identifiers)
+    return folds
+
+
+def _walk_forward_splits(identifiers):
+    """Yield (season, train_index, test_index) in chronological order.
+
+    Each step trains on every row whose target season is before `season`,
+    and tests on the rows that predict `season`.
+    """
+    season2rows = defaultdict(list)
+    for idx, ident in enumerate(identifiers):
+        season2rows[ident[SEASON]].append(idx)
+    seasons = sorted(season2rows)
+
+    train_index = []
+    for last_season, season in zip(seasons, seasons[1:]):
+        train_index = train_index + season2rows[last_season]
+        yield season, train_index, season2rows[season]
+
+
+def _test_stats(year):
+    row = defaultdict(float)
+    row.update({'Age': year - 1980, 'FantasyFantPos': 'QB'})
+    return row
+
+
+def _test_id2year2stats():
+    # The second player sat out 2009 and 2011.
+    return {
+        0: {year: _test_stats(year) for year in xrange(2008, 2013)},
+        1: {year: _test_stats(year) for year in (2008, 2010, 2012)},
+    }
+
+
+def test_walk_forward_splits():
+    matrix, identifiers, features = construct_feature_matrix(
+        _test_id2year2stats())
+
+    gap_seasons = sorted(ident[SEASON] for ident in identifiers
+                         if ident[ID] == 1)
+    assert gap_seasons == [2010, 2012]
+
+    tested = []
+    for season, train_index, test_index in \
+            _walk_forward_splits(identifiers):
+        assert all(identifiers[idx][SEASON] < season for idx in train_index)
+        assert all(identifiers[idx][SEASON] == season for idx in test_index)
+        tested.append(season)
+    assert tested == [2010, 2011, 2012]
+
+
+def walk_forward_backtest(matrix, identifiers, features, id2name, model):
+    """Train on seasons <= Y, predict season Y+1, and roll forward.
+
+    Rows are binned by the season they predict, so unlike the shuffled folds
+    in cross_validate, no later season ever leaks into training. The model is
+    cloned, not modified.
+
+    Models with partial_fit (eg SGDRegressor) are extended with partial_fit
+    on each newly observed season, rather than refit on all history, for as
+    long as the training window populates the same columns. Those steps
+    reuse the previous imputer and scaler, so every increment shares one
+    input and objective scale. When a season brings data into columns that
+    were empty (deeper history), the model is refit from scratch with fresh
+    preprocessing instead, so no populated column is ever dropped. Models
+    without partial_fit are refit, preprocessing included, at every step.
+
+    Returns the taus from compute_taus, keyed by (season, position).
+    """
+    from sklearn.base import clone
+    from sklearn.preprocessing import Imputer
+    from sklearn.preprocessing import StandardScaler
+
+    feature_cols = [idx for idx, (feat, delta) in enumerate(features)
+                    if delta != 0]
+    objective_index = features.index(('fantasy_points', 0))
+
+    def get_features_objective(_matrix):
+        X = _matrix[:, feature_cols]
+        y = _matrix[:, objective_index]
+        return X, y
+
+    model = clone(model)
+    incremental = hasattr(model, 'partial_fit')
+
+    accum_test_identifiers = []
+    accum_test_scores = []
+    accum_test_preds = []
+    n_trained = 0
+    for step, (season, train_index, test_index) in \
+            enumerate(_walk_forward_splits(identifiers)):
+        train_matrix = matrix[train_index, :]
+        test_matrix = matrix[test_index, :]
+
+        # Deep history columns are entirely missing in the earliest
+        # windows. Imputer drops such columns, which would misalign them
+        # with `features`, so zero them instead.
+        window_empty_cols = isnan(train_matrix).all(axis=0)
+        extend = (incremental and step > 0 and
+                  (window_empty_cols == empty_cols).all())
+        if not extend:
+            empty_cols = window_empty_cols
+            train_matrix[:, empty_cols] = 0
+            imputer = Imputer()
+            scaler = StandardScaler()
+            scaler.fit(imputer.fit_transform(train_matrix))
+        train_matrix[:, empty_cols] = 0
+        test_matrix[:, empty_cols] = 0
+        train_imputed = scaler.transform(imputer.transform(train_matrix))
+        test_imputed = scaler.transform(imputer.transform(test_matrix))
+
+        X_train, y_train = get_features_objective(train_imputed)
+        if extend:
+            model.partial_fit(X_train[n_trained:], y_train[n_trained:])
+        else:
+            model.fit(X_train, y_train)
+        n_trained = len(train_index)
+        X_test, y_test = get_features_objective(test_imputed)
+        y_pred = model.predict(X_test)
+
+        info('backtest: predicted %d from %d earlier rows' %
+             (season, len(train_index)))
+        accum_test_identifiers.extend(identifiers[idx] for idx in test_index)
         accum_test_scores.extend(y_test)
         accum_test_preds.extend(y_pred)
 
     pos_ranks_true = position_ranking_lists(
-        accum_test_identifiers, accum_test_scores, id2name)
+        accum_test_identifiers, accum_test_scores, id2name, key=SEASON)
     pos_ranks_pred = position_ranking_lists(
-        accum_test_identifiers, accum_test_preds, id2name)
+        accum_test_identifiers, accum_test_preds, id2name, key=SEASON)
     taus = compute_taus(pos_ranks_true, pos_ranks_pred)
-    for deltapos in sorted(taus, key=lambda x: (x[1], x[0])):
-        print deltapos, taus[deltapos]
+    for season, position in sorted(taus, key=lambda x: (x[1], x[0])):
+        print season, position, taus[season, position]
+
+    return taus
+
+
+def test_walk_forward_backtest():
+    from sklearn.base import BaseEstimator
+
+    calls = []
+
+    class RecordingModel(BaseEstimator):
+        def fit(self, X, y):
+            calls.append(('fit', len(y)))
+            return self
+
+        def partial_fit(self, X, y):
+            calls.append(('partial_fit', len(y)))
+            return self
+
+        def predict(self, X):
+            return X.sum(axis=1)
+
+    def backtest(id2year2stats):
+        matrix, identifiers, features = construct_feature_matrix(
+            id2year2stats)
+        id2name = {id: ('Player %d' % id, 'TM', 'QB')
+                   for id in id2year2stats}
+        del calls[:]
+        return walk_forward_backtest(matrix, identifiers, features, id2name,
+                                     RecordingModel())
+
+    # Two-season careers only ever populate one season of history, so each
+    # step after the first extends the model with just the new season.
+    two_seasons = [(2008, 2009), (2009, 2010), (2010, 2011), (2010, 2011),
+                   (2011, 2012)]
+    taus = backtest({id: {year: _test_stats(year) for year in years}
+                     for id, years in enumerate(two_seasons)})
+    assert calls == [('fit', 1), ('partial_fit', 1), ('partial_fit', 2)]
+    assert sorted(taus) == [(2010, 'QB'), (2011, 'QB'), (2012, 'QB')]
+
+    # Longer careers add deeper history columns at every step, so the model
+    # is refit on the whole window rather than losing those columns.
+    taus = backtest(_test_id2year2stats())
+    assert calls == [('fit', 1), ('fit', 3), ('fit', 4)]
+    assert sorted(taus) == [(2010, 'QB'), (2011, 'QB'), (2012, 'QB')]
+
+
+def predict_current_year(matrix, identifiers, features, id2name, model,
+                         cache=None):
+    """Fit on all rows and predict this year for every player seen last year.
+
+    If a ResultCache is given, the predictions are looked up by a hash of the
+    matrix, model, and predicted rows, and only computed on a miss. On a hit
+    the model is left unfitted. Identifiers are always rebuilt from
+    `identifiers`, never taken from the cache.
+    """
+    delta_1_indices = [idx for idx, ident in enumerate(identifiers)
+                       if ident[DELTA] == 1]
 
-    return
+    if cache is None:
+        current_year_predictions = _predict_current_year(
+            matrix, delta_1_indices, features, model)
+    else:
+        key = result_key(matrix, features, model,
+                         task='predict_current_year', rows=delta_1_indices)
+        current_year_predictions = cache.get(key)
+        if current_year_predictions is None:
+            current_year_predictions = _predict_current_year(
+                matrix, delta_1_indices, features, model)
+            cache.put(key, current_year_predictions)
+
+    current_year_idents = []
+    for idx in delta_1_indices:
+        current_year_idents.append(copy(identifiers[idx]))
+        current_year_idents[-1][DELTA] = 0
+        current_year_idents[-1][SEASON] = BASE_YEAR
+
+    return current_year_predictions, current_year_idents
 
 
-def predict_current_year(matrix, identifiers, features, id2name, model):
+def _predict_current_year(matrix, delta_1_indices, features, model):
+    from sklearn.preprocessing import Imputer
+
     imputed_matrix = Imputer().fit_transform(matrix)
     #scaled_matrix = StandardScaler().fit_transform(imputed_matrix)
     scaled_matrix = imputed_matrix
@@ -271,8 +519,6 @@ def predict_current_year(matrix, identifiers, features, id2name, model):
     # Now, take the delta=1 rows (containing all our data) and make delta=0
     # rows by incrementing the delta indices for tracked stats and incrementing
     # age. This will be used with the trained model to predict this year.
-    delta_1_indices = [idx for idx, ident in enumerate(identifiers)
-                       if ident[DELTA] == 1]
     delta_1_rows = scaled_matrix[delta_1_indices, :]
     delta_1_dicts = (dict(zip(features, row)) for row in delta_1_rows)
 
@@ -296,10 +542,4 @@ def predict_current_year(matrix, identifiers, features, id2name, model):
     delta_0_rows = [[row[feature] for feature in features] for row in
                     delta_0_dicts]
     delta_0_matrix = array(delta_0_rows)
-    current_year_predictions = model.predict(delta_0_matrix[:, feature_cols])
-    current_year_idents = []
-    for idx in delta_1_indices:
-        current_year_idents.append(copy(identifiers[idx]))
-        current_year_idents[-1][DELTA] = 0
-
-    return current_year_predictions, current_year_idents
+    return model.predict(delta_0_matrix[:, feature_cols])